@@ -0,0 +1,197 @@
+import hashlib
+import json
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+# Compression runs in a thread pool: Pillow releases the GIL while encoding, and
+# threads avoid re-importing the entry point (and its models) in worker processes.
+
+
+def _tmp_name(path):
+    # Unique per job so processes sharing the store never touch each other's files
+    return f"{path}.{uuid.uuid4().hex}.tmp"
+
+
+def _atomic_write(path, data):
+    tmp_path = _tmp_name(path)
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def _save_atomic(img, path, fmt, **params):
+    tmp_path = _tmp_name(path)
+    try:
+        img.save(tmp_path, fmt, **params)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def _compress(raw_path, final_path, thumb_path, fmt, quality, thumb_size):
+    try:
+        with Image.open(raw_path) as img:
+            img.load()
+            if fmt == "webp":
+                _save_atomic(img, final_path, "WEBP", quality=quality, method=6)
+            else:
+                _save_atomic(img, final_path, "PNG", optimize=True)
+
+            img.thumbnail(thumb_size)
+            _save_atomic(img, thumb_path, "WEBP" if fmt == "webp" else "PNG", quality=quality)
+    finally:
+        os.remove(raw_path)
+    return final_path
+
+
+class ImageStore:
+    """Content-addressed image store.
+
+    Images live under ``objects/ab/cd/<sha256>.<ext>`` so no directory grows
+    past a few dozen entries even at millions of images, and identical outputs
+    are stored once. ``index/ab/cd.jsonl`` maps headline/prompt/seed to the
+    image digest; lookups only read the one small index shard for their key.
+    Index records are written only once the image object exists on disk.
+    """
+
+    def __init__(self, root, fmt="webp", quality=85, thumb_size=(128, 128),
+                 shard_depth=2, workers=2):
+        self.root = root
+        self.fmt = fmt
+        self.ext = "webp" if fmt == "webp" else "png"
+        self.quality = quality
+        self.thumb_size = tuple(thumb_size)
+        if not 1 <= shard_depth <= 32:
+            raise ValueError(f"shard_depth must be between 1 and 32, got {shard_depth}")
+        self.shard_depth = shard_depth
+        self.workers = workers
+        self._pool = None
+        # digest -> (future, [index records waiting on that object])
+        self._pending = {}
+        self._errors = []
+        os.makedirs(os.path.join(root, "objects"), exist_ok=True)
+        os.makedirs(os.path.join(root, "index"), exist_ok=True)
+
+    @classmethod
+    def from_config(cls, config, default_root):
+        cfg = config.get("image_store", {})
+        return cls(
+            cfg.get("dir", default_root),
+            fmt=cfg.get("format", "webp"),
+            quality=cfg.get("quality", 85),
+            thumb_size=cfg.get("thumbnail_size", (128, 128)),
+            shard_depth=cfg.get("shard_depth", 2),
+            workers=cfg.get("workers", 2),
+        )
+
+    # -----------------------------
+    # Paths
+    # -----------------------------
+    def _shard_parts(self, digest):
+        return [digest[i * 2:i * 2 + 2] for i in range(self.shard_depth)]
+
+    def _shard_dir(self, digest):
+        return os.path.join(self.root, "objects", *self._shard_parts(digest))
+
+    def image_path(self, digest):
+        return os.path.join(self._shard_dir(digest), f"{digest}.{self.ext}")
+
+    def thumbnail_path(self, digest):
+        return os.path.join(self._shard_dir(digest), f"{digest}.thumb.{self.ext}")
+
+    def _raw_path(self, digest):
+        return os.path.join(self._shard_dir(digest), f"{digest}.{uuid.uuid4().hex}.raw.png")
+
+    @staticmethod
+    def _key(headline, prompt, seed):
+        return hashlib.sha256(json.dumps([headline, prompt, seed]).encode("utf-8")).hexdigest()
+
+    def _index_path(self, key):
+        *dirs, leaf = self._shard_parts(key)
+        return os.path.join(self.root, "index", *dirs, f"{leaf}.jsonl")
+
+    # -----------------------------
+    # Store / lookup
+    # -----------------------------
+    def put(self, data, prompt, seed, headline=None):
+        digest = hashlib.sha256(data).hexdigest()
+        key = self._key(headline, prompt, seed)
+        record = {"key": key, "headline": headline, "prompt": prompt, "seed": seed, "digest": digest}
+
+        self._collect(wait=False)
+        if digest in self._pending:
+            records = self._pending[digest][1]
+            if all(r["key"] != key for r in records):
+                records.append(record)
+        elif os.path.exists(self.image_path(digest)):
+            self._append_index(record)
+        else:
+            os.makedirs(self._shard_dir(digest), exist_ok=True)
+            raw_path = self._raw_path(digest)
+            _atomic_write(raw_path, data)
+            self._submit(digest, raw_path, record)
+        return digest
+
+    def lookup(self, prompt, seed, headline=None):
+        key = self._key(headline, prompt, seed)
+        index_path = self._index_path(key)
+        if not os.path.exists(index_path):
+            return None
+        digest = None
+        with open(index_path, encoding="utf-8") as f:
+            for line in f:
+                record = json.loads(line)
+                if record["key"] == key:
+                    digest = record["digest"]
+        return digest
+
+    def _append_index(self, record):
+        if self.lookup(record["prompt"], record["seed"], headline=record["headline"]) == record["digest"]:
+            return
+        index_path = self._index_path(record["key"])
+        os.makedirs(os.path.dirname(index_path), exist_ok=True)
+        with open(index_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    # -----------------------------
+    # Background compression
+    # -----------------------------
+    def _submit(self, digest, raw_path, record):
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=self.workers)
+        future = self._pool.submit(
+            _compress, raw_path, self.image_path(digest), self.thumbnail_path(digest),
+            self.fmt, self.quality, self.thumb_size
+        )
+        self._pending[digest] = (future, [record])
+
+    def _collect(self, wait):
+        """Index finished images and record errors of failed ones.
+
+        Failed jobs clean up their own raw and temporary files; stored objects,
+        possibly written by another process, are never removed here.
+        """
+        for digest, (future, records) in list(self._pending.items()):
+            if not (wait or future.done()):
+                continue
+            del self._pending[digest]
+            try:
+                future.result()
+            except Exception as e:
+                self._errors.append(f"Image {digest} could not be stored: {e}")
+                continue
+            for record in records:
+                self._append_index(record)
+
+    def flush(self):
+        """Wait for background work and return the errors collected since the last flush."""
+        self._collect(wait=True)
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+            self._pool = None
+        errors, self._errors = self._errors, []
+        return errors
@@ -1,64 +1,176 @@
+import hashlib
 import json
 import os
+import threading
+import time
+from functools import lru_cache
 import requests
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib.parse import urldefrag, urljoin
 from bs4 import BeautifulSoup
 import base64
-from datetime import datetime
-from transformers import GPT2LMHeadModel, GPT2Tokenizer, MarianMTModel, MarianTokenizer
 import urllib.request
+from image_store import ImageStore
 
 # Load config
 with open('config.json') as f:
     CONFIG = json.load(f)
 
 out_dir = 'api_out'
-out_dir_t2i = os.path.join(out_dir, 'txt2img')
-os.makedirs(out_dir_t2i, exist_ok=True)
-
-# Load GPT2 model
-gpt_model = GPT2LMHeadModel.from_pretrained(CONFIG['models']['gpt2'])
-gpt_tokenizer = GPT2Tokenizer.from_pretrained(CONFIG['models']['gpt2'])
-gpt_tokenizer.pad_token = gpt_tokenizer.eos_token
-
-def timestamp():
-    return datetime.now().strftime("%Y%m%d-%H%M%S")
+image_store = ImageStore.from_config(CONFIG, os.path.join(out_dir, 'images'))
+
+ARTICLE_FETCH = {"workers": 16, "per_domain": 4, "timeout": 10,
+                 "min_lead_chars": 40, "max_lead_chars": 400, "cache_dir": os.path.join(out_dir, 'articles'),
+                 "cache_max_age_days": 7, **CONFIG.get('article_fetch', {})}
+
+# Shared pooled session for headline pages and article pages
+http_session = requests.Session()
+http_session.mount('http://', HTTPAdapter(pool_connections=32, pool_maxsize=ARTICLE_FETCH['workers']))
+http_session.mount('https://', HTTPAdapter(pool_connections=32, pool_maxsize=ARTICLE_FETCH['workers']))
+
+# Models are loaded once, on first use, so importing this module stays cheap
+@lru_cache(maxsize=None)
+def get_gpt2():
+    from transformers import GPT2LMHeadModel, GPT2Tokenizer
+    model = GPT2LMHeadModel.from_pretrained(CONFIG['models']['gpt2'])
+    tokenizer = GPT2Tokenizer.from_pretrained(CONFIG['models']['gpt2'])
+    tokenizer.pad_token = tokenizer.eos_token
+    return model, tokenizer
+
+@lru_cache(maxsize=None)
+def get_translator():
+    from transformers import MarianMTModel, MarianTokenizer
+    model_name = 'Helsinki-NLP/opus-mt-{source_lang}-{target_lang}'.format(**CONFIG['models']['translation'])
+    return MarianMTModel.from_pretrained(model_name), MarianTokenizer.from_pretrained(model_name)
 
 def read_urls(file_path='default_sites.txt'):
     with open(file_path, 'r') as f:
         return [line.strip() for line in f if line.strip()]
 
-def scrape_headlines(url):
+def get_domain(url):
+    return url.split("//")[-1].split("/")[0].replace("www.", "")
+
+def find_by_rules(soup, rules):
+    found = []
+    for rule in rules:
+        if isinstance(rule, str):
+            found += soup.find_all(rule)
+        elif isinstance(rule, dict):
+            found += soup.find_all(rule['tag'], class_=rule.get('class'))
+    return found
+
+def headline_href(tag, base_url):
+    link = tag if tag.name == 'a' and tag.get('href') else tag.find('a', href=True) or tag.find_parent('a', href=True)
+    if not link:
+        return None
+    href = urldefrag(urljoin(base_url, link['href'])).url
+    if not href.startswith(('http://', 'https://')) or href == urldefrag(base_url).url:
+        return None
+    return href
+
+def scrape_headline_links(url):
     try:
-        response = requests.get(url)
+        response = http_session.get(url, timeout=ARTICLE_FETCH['timeout'])
         soup = BeautifulSoup(response.content, 'html.parser')
-        headlines = []
-        domain = url.split("//")[-1].split("/")[0].replace("www.", "")
-        rules = CONFIG['scraping_rules'].get(domain, [])
-
-        for rule in rules:
-            if isinstance(rule, str):
-                headlines += soup.find_all(rule)
-            elif isinstance(rule, dict):
-                headlines += soup.find_all(rule['tag'], class_=rule.get('class'))
-        
-        return [h.get_text(strip=True) for h in headlines if h.get_text(strip=True) not in CONFIG['ignored_sections']]
+        rules = CONFIG['scraping_rules'].get(get_domain(url), [])
+
+        links = []
+        for h in find_by_rules(soup, rules):
+            text = h.get_text(strip=True)
+            if text not in CONFIG['ignored_sections']:
+                links.append((text, headline_href(h, url)))
+        return links
     except Exception as e:
-        return [f"Error scraping {url}: {e}"]
+        return [(f"Error scraping {url}: {e}", None)]
+
+def scrape_headlines(url):
+    return [text for text, _href in scrape_headline_links(url)]
+
+def _article_cache_path(article_url):
+    key = hashlib.sha256(article_url.encode('utf-8')).hexdigest()
+    return os.path.join(ARTICLE_FETCH['cache_dir'], key[:2], f'{key}.txt')
+
+def extract_lead(html, domain):
+    soup = BeautifulSoup(html, 'html.parser')
+    rules = CONFIG.get('article_rules', {}).get(domain, [])
+    for tag in find_by_rules(soup, rules):
+        text = tag.get_text(" ", strip=True)
+        if len(text) >= ARTICLE_FETCH['min_lead_chars']:
+            return text[:ARTICLE_FETCH['max_lead_chars']]
+    return ''
+
+def _cache_is_fresh(path):
+    max_age = ARTICLE_FETCH['cache_max_age_days'] * 86400
+    return os.path.exists(path) and time.time() - os.path.getmtime(path) < max_age
+
+def prune_article_cache():
+    """Delete cached leads older than `cache_max_age_days`; this is what bounds the cache size."""
+    cache_dir = ARTICLE_FETCH['cache_dir']
+    if not os.path.isdir(cache_dir):
+        return
+    for dirpath, _dirs, files in os.walk(cache_dir):
+        for name in files:
+            path = os.path.join(dirpath, name)
+            if not _cache_is_fresh(path):
+                os.remove(path)
+
+def fetch_article_lead(article_url, semaphore):
+    cache_path = _article_cache_path(article_url)
+    if _cache_is_fresh(cache_path):
+        with open(cache_path, encoding='utf-8') as f:
+            return f.read()
+
+    with semaphore:
+        response = http_session.get(article_url, timeout=ARTICLE_FETCH['timeout'])
+    response.raise_for_status()
+    lead = extract_lead(response.content, get_domain(article_url))
+    if not lead:
+        # Rules missed (or a consent/paywall page): retry on the next run
+        return lead
+
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    tmp_path = f'{cache_path}.{threading.get_ident()}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(lead)
+    os.replace(tmp_path, cache_path)
+    return lead
+
+def fetch_article_leads(article_urls, stop_event=None):
+    """Fetch lead paragraphs concurrently, at most `per_domain` requests per domain at a time.
+
+    Only domains with `article_rules` are fetched. Returns a dict mapping URL to
+    lead text; failed, skipped or stopped fetches map to ''.
+    """
+    article_rules = CONFIG.get('article_rules', {})
+    semaphores = defaultdict(lambda: threading.BoundedSemaphore(ARTICLE_FETCH['per_domain']))
+    unique_urls = list(dict.fromkeys(u for u in article_urls if u and get_domain(u) in article_rules))
+    for u in unique_urls:
+        semaphores[get_domain(u)]  # create up front; defaultdict is not thread-safe
+
+    def fetch(u):
+        if stop_event and stop_event.is_set():
+            return ''
+        try:
+            return fetch_article_lead(u, semaphores[get_domain(u)])
+        except Exception:
+            return ''
+
+    with ThreadPoolExecutor(max_workers=ARTICLE_FETCH['workers']) as pool:
+        return dict(zip(unique_urls, pool.map(fetch, unique_urls)))
 
 def translate_text(text):
-    src = CONFIG['models']['translation']['source_lang']
-    tgt = CONFIG['models']['translation']['target_lang']
-    model_name = f'Helsinki-NLP/opus-mt-{src}-{tgt}'
-    model = MarianMTModel.from_pretrained(model_name)
-    tokenizer = MarianTokenizer.from_pretrained(model_name)
-    encoded = tokenizer.encode(text, return_tensors="pt", padding=True)
-    translated = model.generate(encoded, max_length=100)
-    return tokenizer.decode(translated[0], skip_special_tokens=True)
+    translation_model, translation_tokenizer = get_translator()
+    encoded = translation_tokenizer.encode(text, return_tensors="pt", padding=True, truncation=True)
+    translated = translation_model.generate(encoded, max_length=min(512, max(100, 2 * encoded.shape[-1])))
+    return translation_tokenizer.decode(translated[0], skip_special_tokens=True)
 
 def generate_description(text):
+    gpt_model, gpt_tokenizer = get_gpt2()
     inputs = gpt_tokenizer.encode(text, return_tensors='pt')
     outputs = gpt_model.generate(
-        inputs, max_length=100, no_repeat_ngram_size=2,
+        inputs, max_length=max(100, inputs.shape[-1] + 60), no_repeat_ngram_size=2,
         top_p=0.95, top_k=60, do_sample=True,
         attention_mask=(inputs != gpt_tokenizer.pad_token_id),
         pad_token_id=gpt_tokenizer.eos_token_id
@@ -73,7 +185,7 @@ def call_api(endpoint, **payload):
     response = urllib.request.urlopen(req)
     return json.loads(response.read().decode())
 
-def generate_image(prompt, seed=1, steps=20):
+def generate_image(prompt, seed=1, steps=20, headline=None):
     payload = {
         "prompt": prompt, "negative_prompt": "",
         "seed": seed, "steps": steps,
@@ -82,38 +194,54 @@ def generate_image(prompt, seed=1, steps=20):
         "n_iter": 1, "batch_size": 1
     }
     images = call_api('sdapi/v1/txt2img', **payload).get('images', [])
-    for idx, img_b64 in enumerate(images):
-        save_path = os.path.join(out_dir_t2i, f'image_{timestamp()}_{idx}.png')
-        with open(save_path, "wb") as f:
-            f.write(base64.b64decode(img_b64))
+    return [image_store.put(base64.b64decode(img_b64), prompt, seed, headline=headline) for img_b64 in images]
 
-def process_urls(urls, stop_event=None, generate_images=True):
+def process_urls(urls, stop_event=None, generate_images=True, follow_links=False):
     logs = []
+    try:
+        _process_urls(urls, logs, stop_event, generate_images, follow_links)
+    finally:
+        # Wait for background compression so every generated image is indexed
+        logs.extend(image_store.flush())
+    return logs
+
+def _process_urls(urls, logs, stop_event, generate_images, follow_links):
+    if follow_links:
+        prune_article_cache()
     for url in urls:
         if stop_event and stop_event.is_set():
             logs.append("Scraping stopped by user.")
             break
 
         logs.append(f"Scraping {url}")
-        headlines = scrape_headlines(url)
+        links = scrape_headline_links(url)
+        leads = {}
+        if follow_links:
+            logs.append("Fetching article pages...")
+            leads = fetch_article_leads((href for _text, href in links), stop_event)
 
-        for headline in headlines:
+        for headline, href in links:
             if stop_event and stop_event.is_set():
                 logs.append("Scraping stopped by user.")
-                return logs
+                return
 
             logs.append(f"Headline: {headline}")
             translated = translate_text(headline)
             logs.append(f"Translated: {translated}")
-            desc = generate_description(translated)
+            prompt = translated
+            lead = leads.get(href)
+            if lead:
+                translated_lead = translate_text(lead)
+                logs.append(f"Lead: {translated_lead}")
+                prompt = f"{translated}. {translated_lead}"
+            desc = generate_description(prompt)
             logs.append(f"Description: {desc}")
 
             if generate_images:
                 logs.append(f"Generating image...")
-                generate_image(desc)
-                logs.append("Image generated.")
+                digests = generate_image(desc, headline=headline)
+                logs.append(f"Image generated: {', '.join(digests)}")
             else:
                 logs.append("Image generation skipped.")
 
     logs.append("Scraping completed.")
-    return logs
@@ -0,0 +1,105 @@
+import io
+import os
+import threading
+
+import pytest
+from PIL import Image
+
+import image_store
+from image_store import ImageStore
+
+
+def png_bytes(color=(200, 10, 10)):
+    buf = io.BytesIO()
+    Image.new("RGB", (64, 64), color).save(buf, "PNG")
+    return buf.getvalue()
+
+
+def index_lines(root):
+    lines = []
+    for dirpath, _dirs, files in os.walk(os.path.join(root, "index")):
+        for name in files:
+            with open(os.path.join(dirpath, name), encoding="utf-8") as f:
+                lines += f.read().splitlines()
+    return lines
+
+
+def stored_files(root):
+    return sorted(name for _dirpath, _dirs, files in os.walk(os.path.join(root, "objects")) for name in files)
+
+
+def test_identical_bytes_are_stored_once(tmp_path):
+    store = ImageStore(str(tmp_path))
+    data = png_bytes()
+    first = store.put(data, "prompt a", 1, headline="a")
+    second = store.put(data, "prompt b", 2, headline="b")
+    assert store.flush() == []
+
+    assert first == second
+    assert stored_files(str(tmp_path)) == [f"{first}.thumb.webp", f"{first}.webp"]
+    assert store.lookup("prompt a", 1, headline="a") == first
+    assert store.lookup("prompt b", 2, headline="b") == first
+
+
+def test_index_is_written_only_after_object_exists(tmp_path, monkeypatch):
+    release = threading.Event()
+    real_compress = image_store._compress
+
+    def blocked_compress(*args):
+        release.wait(5)
+        return real_compress(*args)
+
+    monkeypatch.setattr(image_store, "_compress", blocked_compress)
+    store = ImageStore(str(tmp_path))
+    digest = store.put(png_bytes(), "prompt", 1, headline="h")
+    assert not os.path.exists(store.image_path(digest))
+    assert store.lookup("prompt", 1, headline="h") is None
+
+    release.set()
+    assert store.flush() == []
+    assert store.lookup("prompt", 1, headline="h") == digest
+    assert os.path.exists(store.image_path(digest))
+
+
+def test_repeated_put_does_not_duplicate_index_lines(tmp_path):
+    store = ImageStore(str(tmp_path))
+    data = png_bytes()
+    store.put(data, "prompt", 1, headline="h")
+    store.put(data, "prompt", 1, headline="h")
+    store.flush()
+    store.put(data, "prompt", 1, headline="h")
+    store.flush()
+
+    assert len(index_lines(str(tmp_path))) == 1
+
+
+def test_failed_encode_is_reported_and_cleaned_up(tmp_path):
+    store = ImageStore(str(tmp_path))
+    digest = store.put(b"not an image", "prompt", 1)
+    errors = store.flush()
+
+    assert len(errors) == 1 and digest in errors[0]
+    assert stored_files(str(tmp_path)) == []
+    assert index_lines(str(tmp_path)) == []
+    assert store.lookup("prompt", 1) is None
+
+
+def test_failed_encode_keeps_existing_object(tmp_path):
+    store = ImageStore(str(tmp_path))
+    digest = store.put(png_bytes(), "prompt", 1)
+    store.flush()
+    # Simulate a second job for the same digest failing
+    raw_path = store._raw_path(digest)
+    with open(raw_path, "wb") as f:
+        f.write(b"not an image")
+    store._submit(digest, raw_path, {"key": "x"})
+    assert len(store.flush()) == 1
+    assert os.path.exists(store.image_path(digest))
+    assert os.path.exists(store.thumbnail_path(digest))
+    assert not os.path.exists(raw_path)
+
+
+@pytest.mark.parametrize("depth", [0, 33])
+def test_shard_depth_is_validated(tmp_path, depth):
+    with pytest.raises(ValueError):
+        ImageStore(str(tmp_path), shard_depth=depth)
@@ -0,0 +1,99 @@
+import os
+import threading
+
+import pytest
+from bs4 import BeautifulSoup
+
+import pipeline
+
+PAGE_URL = "https://www.repubblica.it/"
+
+
+def first_heading(html):
+    return BeautifulSoup(html, "html.parser").find("h2")
+
+
+@pytest.mark.parametrize("html, expected", [
+    ('<h2><a href="/politica/articolo-1">Title</a></h2>', "https://www.repubblica.it/politica/articolo-1"),
+    ('<a href="https://example.com/a#comments"><h2>Title</h2></a>', "https://example.com/a"),
+    ('<h2><a href="#">Title</a></h2>', None),
+    ('<h2><a href="/#top">Title</a></h2>', None),
+    ('<h2><a href="javascript:void(0)">Title</a></h2>', None),
+    ('<h2><a href="mailto:redazione@example.com">Title</a></h2>', None),
+    ('<h2>Title</h2>', None),
+])
+def test_headline_href(html, expected):
+    assert pipeline.headline_href(first_heading(html), PAGE_URL) == expected
+
+
+class FakeResponse:
+    def __init__(self, html):
+        self.content = html.encode("utf-8")
+
+    def raise_for_status(self):
+        pass
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setitem(pipeline.ARTICLE_FETCH, "cache_dir", str(tmp_path))
+    return tmp_path
+
+
+@pytest.fixture
+def fake_get(monkeypatch):
+    pages = {}
+    calls = []
+
+    def get(url, timeout=None):
+        calls.append(url)
+        return FakeResponse(pages[url])
+
+    monkeypatch.setattr(pipeline.http_session, "get", get)
+    return pages, calls
+
+
+def test_fetch_article_leads_skips_domains_without_rules(cache_dir, fake_get, monkeypatch):
+    monkeypatch.setitem(pipeline.CONFIG, "article_rules", {"repubblica.it": [{"tag": "p", "class": "story__summary"}]})
+    pages, calls = fake_get
+    lead = "Il governo ha approvato oggi la nuova legge di bilancio dopo un lungo dibattito."
+    pages["https://www.repubblica.it/a"] = f'<p>Cookie banner text that is long enough to match</p><p class="story__summary">{lead}</p>'
+
+    leads = pipeline.fetch_article_leads(["https://www.repubblica.it/a", "https://example.com/b", None])
+
+    assert leads == {"https://www.repubblica.it/a": lead}
+    assert calls == ["https://www.repubblica.it/a"]
+
+
+def test_fetch_article_leads_stops_when_stop_event_is_set(cache_dir, fake_get):
+    _pages, calls = fake_get
+    stop_event = threading.Event()
+    stop_event.set()
+
+    leads = pipeline.fetch_article_leads(["https://www.repubblica.it/a", "https://www.corriere.it/b"], stop_event)
+
+    assert leads == {"https://www.repubblica.it/a": "", "https://www.corriere.it/b": ""}
+    assert calls == []
+
+
+def test_empty_leads_are_not_cached(cache_dir, fake_get):
+    pages, calls = fake_get
+    url = "https://www.repubblica.it/a"
+    pages[url] = "<p>Accetta i cookie per continuare a leggere questo articolo.</p>"
+
+    assert pipeline.fetch_article_leads([url]) == {url: ""}
+    assert pipeline.fetch_article_leads([url]) == {url: ""}
+    assert calls == [url, url]
+    assert not any(files for _dirpath, _dirs, files in os.walk(cache_dir))
+
+
+def test_stale_cache_entries_are_pruned(cache_dir):
+    path = pipeline._article_cache_path("https://www.repubblica.it/a")
+    os.makedirs(os.path.dirname(path))
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("old lead")
+    os.utime(path, (0, 0))
+
+    pipeline.prune_article_cache()
+
+    assert not os.path.exists(path)